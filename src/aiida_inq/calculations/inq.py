@@ -1,10 +1,41 @@
 # -*- coding: utf-8 -*-
 import os
-from collections import defaultdict
-import numpy as np
+import itertools
 from aiida import orm # type: ignore
 from aiida.engine import CalcJob # type: ignore
 from aiida.common.datastructures import CalcInfo, CodeInfo # type: ignore
+from aiida.common.exceptions import InputValidationError # type: ignore
+
+# Subcommands accepted by `inq kpoints`, and those that take no value.
+_KPOINTS_KEYS = frozenset(('gamma', 'grid', 'shifted grid', 'insert', 'clear'))
+_KPOINTS_FLAGS = frozenset(('gamma', 'clear'))
+
+
+def validate_parameters(value, _):
+    """
+    Validate the ``parameters`` input, so a missing run type or malformed
+    k-point settings are rejected before the job is submitted.
+    """
+    parameters = value.get_dict()
+
+    if not parameters.get('run', None):
+        return 'No run type was specified in the input parameters.'
+
+    kpoints = parameters.get('kpoints', {})
+
+    if not isinstance(kpoints, dict):
+        return 'The `kpoints` parameters must be a dictionary.'
+
+    unknown = set(kpoints) - _KPOINTS_KEYS
+    if unknown:
+        return (
+            f'Unknown `kpoints` parameters: {", ".join(sorted(unknown))}. '
+            f'Valid keys are: {", ".join(sorted(_KPOINTS_KEYS))}.'
+        )
+
+    for key in _KPOINTS_FLAGS & set(kpoints):
+        if kpoints[key] not in ('', None):
+            return f'The `kpoints` parameter `{key}` does not take a value.'
 
 
 class InqCalculation(CalcJob):
@@ -25,6 +56,12 @@ class InqCalculation(CalcJob):
 
     # Where to copy files to from a parent_folder
     _restart_copy_to = _DEFAULT_INQ_SUBFOLDER
+
+    # Results that get a header echoed before them in the results file
+    _HEADED_RESULTS = frozenset(('forces', 'dipole', 'current', 'total-energy', 'time'))
+
+    # Results that require the real-time parameters to be set
+    _REAL_TIME_RESULTS = frozenset(('dipole', 'current'))
  
     @classmethod
     def define(cls, spec):
@@ -35,6 +72,7 @@ class InqCalculation(CalcJob):
             'parameters', 
             valid_type=orm.Dict, 
             required=True,
+            validator=validate_parameters,
             help='Input parameters for the input file.'
         )
         spec.input(
@@ -102,6 +140,12 @@ class InqCalculation(CalcJob):
             required=False,
             help='The relaxed output structure.'
         )
+        spec.output(
+            'output_forces',
+            valid_type=orm.ArrayData,
+            required=False,
+            help='The forces on the atoms, stored in the `forces` array.'
+        )
 
         spec.default_output_node = 'output_parameters'
 
@@ -128,9 +172,6 @@ class InqCalculation(CalcJob):
         :return: `aiida.common.datastructures.CalcInfo` instance.
         """
 
-        # Verify inputs
-        #self.verify_inputs()
-
         # Initialize settings if set
         if 'settings' in self.inputs:
             settings = self.inputs.settings.get_dict() # Might to make a check for this
@@ -154,65 +195,77 @@ class InqCalculation(CalcJob):
         # Create subfolders for scratch and permanent data
         folder.get_subfolder(self._DEFAULT_INQ_SUBFOLDER, create=True)
 
-        input_filename = folder.get_abs_path(self._DEFAULT_INPUT_FILE)
-        f = open(input_filename, 'w')
         # Initiate the initial settings
-        f.write("""#!/bin/bash
-
-set -e
-set -x
+        lines = [
+            '#!/bin/bash',
+            '',
+            'set -e',
+            'set -x',
+            '',
+        ]
 
-""")
         # Initiate the cell
-        cell = atoms.cell
-        scale = np.max(cell)
+        cell = atoms.cell.array
+        scale = cell.max()
         sc = cell/scale
-        f.write(f"inq cell {' '.join(sc[0].astype('str'))} {' '.join(sc[1].astype('str'))} {' '.join(sc[2].astype('str'))} scale {scale} angstrom\n")
+        lines.append(
+            ('inq cell' + ' %.17g' * 9 + ' scale %s angstrom') % (*sc.ravel(), scale)
+        )
 
-        # Add the atoms
-        for atom in atoms:
-            f.write(f"inq ions insert fractional {atom.symbol} {' '.join(atom.scaled_position.astype('str'))}\n")
+        # Add the atoms, formatting all rows in a single pass
+        positions = atoms.get_scaled_positions(wrap=False)
+        symbols = atoms.get_chemical_symbols()
+        if symbols:
+            atom_format = '\n'.join(
+                ['inq ions insert fractional %s %.17g %.17g %.17g'] * len(symbols)
+            )
+            lines.append(atom_format % tuple(itertools.chain.from_iterable(
+                (s, p[0], p[1], p[2]) for s, p in zip(symbols, positions)
+            )))
 
         # Iterate through the parameters
         run_type = parameters.pop('run', None)
-        if run_type is None:
-            self.report(f'There was no run type specified.')
-            self.exit_codes.NO_RUN_TYPE_SPECIFIED
-        else:
-            if type(run_type) is dict:
-                run_type = list(run_type.keys())[0]
+        if not run_type:
+            raise InputValidationError('No run type was specified in the input parameters.')
+        if isinstance(run_type, dict):
+            run_type = next(iter(run_type))
         for key, val in parameters.items():
             for k, v in val.items():
-                if type(v) is list:
+                if isinstance(v, list):
                     for item in v:
-                        f.write(f"inq {key} {k} {item}\n")
+                        lines.append(f"inq {key} {k} {item}")
                 else:
-                    f.write(f"inq {key} {k} {v}\n")
+                    lines.append(f"inq {key} {k} {v}")
 
-        f.write(f'inq run {run_type}\n')
+        lines.append(f'inq run {run_type}')
 
         # Print out the final structure
-        f.write(f'inq cell >> {self._DEFAULT_RESULTS_FILE}\n')
-        f.write(f'inq ions >> {self._DEFAULT_RESULTS_FILE}\n')
+        lines.append(f'inq cell >> {self._DEFAULT_RESULTS_FILE}')
+        lines.append(f'inq ions >> {self._DEFAULT_RESULTS_FILE}')
 
         # Set any requested results to print to the results file
         for key, val in results.items():
             for k, v in val.items():
-                if str(k).lower() in ['forces', 'dipole', 'current', 'total-energy', 'time']:
+                result = str(k).lower()
+                if result in self._HEADED_RESULTS:
                     # Check if dipole and current were set in the input parameters.
-                    if str(k).lower() in ['dipole', 'current']:
+                    if result in self._REAL_TIME_RESULTS:
                         real_time = parameters.get('real-time', None)
                         if real_time is None:
                             self.report(f'Input parameter not set for `{k}` results.')
                             self.exit_codes.PARAMETER_NOT_REQUESTED
-                    f.write(f'echo ""\necho "{k.capitalize()}:" >> {self._DEFAULT_RESULTS_FILE}\n')
-                f.write(f"inq results {key} {k} {v} >> {self._DEFAULT_RESULTS_FILE}\n")
+                    lines.append('echo ""')
+                    lines.append(f'echo "{k.capitalize()}:" >> {self._DEFAULT_RESULTS_FILE}')
+                lines.append(f"inq results {key} {k} {v} >> {self._DEFAULT_RESULTS_FILE}")
 
         # Echo that AiiDA finished.
         # Will be used to determine if a job finished.
-        f.write(f'\necho "AiiDA DONE"')
+        lines.append('')
+        lines.append('echo "AiiDA DONE"')
 
-        f.flush()
+        # Write the whole input file at once.
+        with folder.open(self._DEFAULT_INPUT_FILE, 'w') as handle:
+            handle.write('\n'.join(lines))
 
         local_copy_list = []
         remote_copy_list = []
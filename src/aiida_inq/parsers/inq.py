@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import io
+import os
+import re
+
 from ase import units, Atoms, Atom
 import numpy as np
 
@@ -9,9 +13,20 @@ from aiida.engine import ExitCode
 from aiida import orm
 from aiida.plugins import DataFactory
 
-from aiida.plugins import CalculationFactory
+from ..calculations.inq import InqCalculation
+
+
+# Section headers written to the output and results files.
+_SECTION_RE = re.compile(
+    r'(Cell:|Ions|Energy:|Forces:|Total-steps:|Total-time:|Time:|'
+    r'Total-energy|Dipole:|Current:)'
+)
 
-InqCalculation = CalculationFactory('inq.inq')
+# Conversion factors to eV for the energy units INQ reports.
+_UNIT_TABLE = {
+    name: getattr(units, name)
+    for name in ('Hartree', 'Ha', 'Rydberg', 'Ry', 'eV')
+}
 
 
 class InqParser(Parser):
@@ -31,6 +46,7 @@ class InqParser(Parser):
         self.result_dict = {}
         self.state = None
         self.atoms = None
+        self.forces = None
 
     def parse(self, **kwargs):
         """
@@ -42,82 +58,81 @@ class InqParser(Parser):
         output_filename = self.node.get_option('output_filename')
 
         # Check that folder content is as expected
-        files_retrieved = self.node.get_retrieve_temporary_list()
-        files_expected = [output_filename]
+        files_retrieved = set(os.listdir(temp_folder))
+        files_expected = {output_filename}
 
         results_filename = ''
-        if 'results' in self.node.inputs.parameters.get_dict():
+        if 'results' in self.node.inputs.parameters.keys():
             results_filename = self.node.get_option('results_filename')
-            files_expected.append(results_filename)
+            files_expected.add(results_filename)
 
-        # Note: set(A) <= set(B) checks whether A is a subset of B
-        if not set(files_expected) <= set(files_retrieved):
+        # Note: A <= B checks whether A is a subset of B
+        if not files_expected <= files_retrieved:
             self.logger.error("Found files '{}', expected to find '{}'".format(
                 files_retrieved, files_expected))
             return self.exit_codes.ERROR_MISSING_OUTPUT_FILES
 
-        # Read output file
-        if results_filename:
-            self.logger.info(f"Parsing '{results_filename}")
-            with open(f'{temp_folder}/{results_filename}', 'r') as fhandle:
-                results_lines = [line.strip('\n') for line in fhandle.readlines()]       
-
-        self.logger.info("Parsing '{}'".format(output_filename))
-        with open(f'{temp_folder}/{output_filename}', 'r') as fhandle:
-            output_lines = [line.strip('\n') for line in fhandle.readlines()]
-
-        # Check if INQ finished:
-        inq_done = False
-        if 'AiiDA DONE' in output_lines[-1]:
-            inq_done = True
-        if not inq_done:
+        # Check if INQ finished before parsing anything.
+        output_path = f'{temp_folder}/{output_filename}'
+        if 'AiiDA DONE' not in self.read_last_line(output_path):
             return self.exit_codes.ERROR_OUTPUT_STDOUT_INCOMPLETE
 
+        # Parse the output file line by line without holding it in memory.
         if results_filename:
-            lines = results_lines
+            self.logger.info(f"Parsing '{results_filename}")
+            parse_path = f'{temp_folder}/{results_filename}'
         else:
-            lines = output_lines
+            self.logger.info("Parsing '{}'".format(output_filename))
+            parse_path = output_path
 
-        for e, line in enumerate(lines):
-            if 'Cell:' in line:
-                self.state = 'cell'
-                self.atoms = Atoms()
-                continue
-            elif 'Ions' in line:
-                self.state = 'ions'
-                continue
-            elif 'Energy:' in line:
-                self.state = 'energy'
-                self.result_dict[self.state] = {'unit': 'eV'}
-                continue
-            elif 'Forces:' in line:
-                self.state = 'forces'
-                self.result_dict[self.state] = {'values': []}
-                continue
-            elif 'Total-steps:' in line:
-                self.state = 'total-steps'
-                continue
-            elif 'Total-time:' in line:
-                self.state = 'total-time'
-                continue
-            elif 'Time:' in line:
-                self.state = 'time'
-                self.result_dict[self.state] = {'values': []}
-                continue
-            elif 'Total-energy' in line:
-                self.state = 'total-energy'
-                self.result_dict[self.state] = {'values': []}
-                self.result_dict['time'] = {'values': []}
-                continue
-            elif 'Dipole:' in line:
-                self.state = 'dipole'
-                self.result_dict[self.state] = {'values': []}
-                self.result_dict['time'] = {'values': []}
-                continue
-            elif 'Current:' in line:
-                self.state = 'current'
-                self.result_dict[self.state] = {'values': []}
-                self.result_dict['time'] = {'values': []}
+        with open(parse_path, 'r') as fhandle:
+            self.parse_lines(fhandle)
+
+        self.out('output_parameters', orm.Dict(dict=self.result_dict))
+
+        if self.forces is not None:
+            forces = orm.ArrayData()
+            forces.set_array('forces', self.forces)
+            self.out('output_forces', forces)
+
+        if self.atoms:
+            StructureData = DataFactory('core.structure')
+            structure = StructureData(ase=self.atoms)
+            self.out('output_structure', structure)
+
+        return ExitCode(0)
+
+    def parse_lines(self, handle):
+        """
+        Run the section state machine over the lines of an open file.
+
+        :param handle: an open file handle, iterated line by line.
+        """
+
+        # Bind frequently used objects locally for the scan below. Force
+        # rows are collected and converted in one pass after the loop.
+        result_dict = self.result_dict
+        cell = []
+        force_lines = []
+        append_force = force_lines.append
+
+        for raw in handle:
+            line = raw.rstrip('\n')
+
+            section = _SECTION_RE.match(line)
+            if section:
+                self.state = section.group(1).rstrip(':').lower()
+                match self.state:
+                    case 'cell':
+                        self.atoms = Atoms()
+                        cell = []
+                    case 'energy':
+                        result_dict[self.state] = {'unit': 'eV'}
+                    case 'time':
+                        result_dict[self.state] = {'values': []}
+                    case 'total-energy' | 'dipole' | 'current':
+                        result_dict[self.state] = {'values': []}
+                        result_dict['time'] = {'values': []}
                 continue
             elif line == '':
                 self.state = None
@@ -126,12 +141,10 @@ class InqParser(Parser):
             match self.state:
 
                 case 'cell':
-                    cell_lines = lines[e:e+3]
-                    cell = []
-                    for cl in cell_lines:
-                        cell.append(np.array(cl.split()[-3:]).astype('float'))
-                    self.atoms.set_cell(cell)
-                    self.state = None
+                    cell.append(np.array(line.split()[-3:]).astype('float'))
+                    if len(cell) == 3:
+                        self.atoms.set_cell(cell)
+                        self.state = None
 
                 case 'ions':
                     temp = line.split()
@@ -139,45 +152,57 @@ class InqParser(Parser):
 
                 case 'energy':
                     values = line.split()
-                    unit = getattr(units, values[-1])
-                    self.result_dict[self.state][values[0]] = float(values[-2]) * unit
+                    unit = _UNIT_TABLE.get(values[-1])
+                    if unit is None:
+                        unit = getattr(units, values[-1])
+                    result_dict[self.state][values[0]] = float(values[-2]) * unit
 
                 case 'forces':
-                    values = line.split()
-                    self.result_dict[self.state]['values'].append(np.array(values).astype('float'))
+                    append_force(line)
 
                 case 'total-steps':
-                    self.result_dict[self.state] = int(line)
+                    result_dict[self.state] = int(line)
 
                 case 'total-time':
-                    self.result_dict[self.state] = float(line)
+                    result_dict[self.state] = float(line)
 
                 case 'time':
-                    self.result_dict[self.state]['values'].append(float(line))
+                    result_dict[self.state]['values'].append(float(line))
 
                 case 'total-energy':
                     values = line.split()
                     if len(values) > 2:
-                        self.result_dict[self.state]['unit'] = values[-1].strip('[]')
-                        self.result_dict['time']['unit'] = values[1].strip('[]')
+                        result_dict[self.state]['unit'] = values[-1].strip('[]')
+                        result_dict['time']['unit'] = values[1].strip('[]')
                     else:
-                        self.result_dict[self.state]['values'].append(float(values[1]))
-                        self.result_dict['time']['values'].append(float(values[0]))
+                        result_dict[self.state]['values'].append(float(values[1]))
+                        result_dict['time']['values'].append(float(values[0]))
 
                 case 'dipole':
                     self.parse_dipole_current(line)
 
                 case 'current':
                     self.parse_dipole_current(line)      
-            
-        self.out('output_parameters', orm.Dict(dict=self.result_dict))
 
-        if self.atoms:
-            StructureData = DataFactory('core.structure')
-            structure = StructureData(ase=self.atoms)
-            self.out('output_structure', structure)
+        # Forces are stored as an array node rather than in the results Dict.
+        if force_lines:
+            self.forces = np.loadtxt(io.StringIO('\n'.join(force_lines)), ndmin=2)
 
-        return ExitCode(0)
+    @staticmethod
+    def read_last_line(path, size=64):
+        """
+        Return the last non-empty line of a file by reading only its tail.
+
+        :param path: path of the file to check.
+        :param size: number of bytes to read from the end of the file.
+        """
+
+        with open(path, 'rb') as fhandle:
+            fhandle.seek(0, os.SEEK_END)
+            fhandle.seek(max(0, fhandle.tell() - size))
+            tail = fhandle.read().decode(errors='replace')
+
+        return tail.rstrip().rsplit('\n', 1)[-1]
 
     def parse_dipole_current(self, line):
         values = line.split()
@@ -4,13 +4,12 @@
 from aiida import orm
 from aiida.common import AttributeDict
 from aiida.engine import BaseRestartWorkChain, while_
-from aiida.plugins import CalculationFactory
+from aiida.manage.caching import enable_caching
+from ..calculations.inq import InqCalculation
 from .protocols.utils import suggested_energy_cutoff
 
 from .protocols.utils import ProtocolMixin # type: ignore
 
-InqCalculation = CalculationFactory('inq.inq')
-
 
 class InqBaseWorkChain(ProtocolMixin, BaseRestartWorkChain):
     """
@@ -52,6 +51,16 @@ class InqBaseWorkChain(ProtocolMixin, BaseRestartWorkChain):
             default = lambda: orm.Bool(False),
             help = 'Whether to clean all related work folders.'
         )
+        spec.input(
+            'use_cache',
+            valid_type = orm.Bool,
+            default = lambda: orm.Bool(False),
+            help = (
+                'If `True`, enable caching for the `InqCalculation` launched '
+                'by this workchain, so a calculation with identical inputs '
+                'reuses the outputs of an earlier one.'
+            )
+        )
 
         spec.outline(
             cls.setup,
@@ -158,8 +167,21 @@ class InqBaseWorkChain(ProtocolMixin, BaseRestartWorkChain):
         `BaseRestartWorkChain` to submit the calculations in the internal loop.
         """
 
-        super(InqBaseWorkChain, self).setup()
+        super().setup()
         self.ctx.inputs = AttributeDict(
             self.exposed_inputs(InqCalculation, 'inq'))
-        
-        self.ctx.inputs.parameters = self.inputs.inq.parameters
\ No newline at end of file
+
+    def run_process(self):
+        """
+        Run the next process, with caching enabled for `InqCalculation`
+        when `use_cache` is set.
+
+        Caching is decided when the calculation node is stored, which
+        happens in this step, so the context has to wrap it here.
+        """
+
+        if self.inputs.use_cache:
+            with enable_caching(identifier='aiida.calculations:inq.inq'):
+                return super().run_process()
+
+        return super().run_process()
\ No newline at end of file
@@ -4,16 +4,32 @@
 from aiida import orm
 from aiida.common import AttributeDict
 from aiida.engine import WorkChain, while_, ToContext
-from aiida.plugins import CalculationFactory, WorkflowFactory
-
-from aiida_inq.calculations.functions.create_kpoints_from_distance import create_kpoints_from_distance
-
+from ..calculations.inq import InqCalculation
+from .base import InqBaseWorkChain
 from .protocols.utils import ProtocolMixin, suggested_energy_cutoff
 
 import numpy as np
 
-InqCalculation = CalculationFactory('inq.inq')
-InqBaseWorkchain = WorkflowFactory('inq.base')
+
+def find_converged(values, delta):
+    """
+    Find the first converged point of a sweep.
+
+    :param values: list of ``[parameter, total_energy]`` pairs in the order
+        they were calculated.
+    :param delta: largest total energy difference considered converged.
+
+    :return: index of the first point whose total energy is within ``delta``
+        of the next point, or ``None`` if no such point exists yet.
+    """
+
+    energies = np.array([value[1] for value in values])
+    converged = np.flatnonzero(np.abs(np.diff(energies)) <= delta)
+
+    if converged.size == 0:
+        return None
+
+    return int(converged[0])
 
 
 class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
@@ -26,9 +42,9 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
 
         super().define(spec)
         spec.expose_inputs(
-            InqBaseWorkchain,
+            InqBaseWorkChain,
             namespace = 'conv',
-            exclude = ('clean_workdir', 'inq.structure', 'max_iterations'),
+            exclude = ('clean_workdir', 'use_cache', 'inq.structure', 'max_iterations'),
             namespace_options = {
                 'help': 'Inputs for the INQ Base Workchain.'
             }
@@ -69,6 +85,17 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
                 'pseudos.yaml protocol file. Units are considered to be Ha.'
             )
         )
+        spec.input(
+            'pseudo_set',
+            valid_type = orm.Str,
+            required = False,
+            default = lambda: orm.Str('pseudodojo_pbe'),
+            help = (
+                'The pseudopotential set from the pseudos.yaml protocol file '
+                'used to suggest the starting energy cutoff when '
+                '`energy_start` is not provided.'
+            )
+        )
         spec.input(
             'energy_step',
             valid_type = orm.Int,
@@ -101,18 +128,23 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
                 'be cleaned at the end of the workflow.'
             )
         )
+        spec.input(
+            'use_cache',
+            valid_type = orm.Bool,
+            default = lambda: orm.Bool(False),
+            help = (
+                'If `True`, enable caching for the INQ calculations of the '
+                'sweeps, so points that were already computed with identical '
+                'inputs reuse the earlier results.'
+            )
+        )
 
         spec.outline(
             cls.setup,
 
-            while_(cls.should_run_energy)(
-                cls.run_energy,
-                cls.check_energy
-            ),
-
-            while_(cls.should_run_kspacing)(
-                cls.run_kspacing,
-                cls.check_kspacing
+            while_(cls.should_run_sweeps)(
+                cls.run_sweeps,
+                cls.check_sweeps
             ),
 
             cls.results,
@@ -187,7 +219,7 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
             metadata['options'] = options
         inputs['inq']['metadata'] = metadata
 
-        inq = InqBaseWorkchain.get_builder_from_protocol(
+        inq = InqBaseWorkChain.get_builder_from_protocol(
             code,
             structure,
             protocol = protocol,
@@ -202,6 +234,7 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
         builder.conv = inq
         builder.structure = structure
         builder.clean_workdir = inputs['clean_workdir']
+        builder.pseudo_set = orm.Str(inputs['pseudo_set'])
 
         # See if any of the other values are passed in with kwargs.
         for kwarg in kwargs.keys():
@@ -212,33 +245,133 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
 
     def setup(self):
         """
-        Call the `setup` of the `BaseRestartWorkChain` and then create the 
-        inputs dictionary in `self.ctx.inputs`.
+        Initialize the sweep state and create the base inputs dictionary
+        in `self.ctx.inputs`.
 
-        This `self.ctx.inputs` dictionary will be used by the 
-        `BaseRestartWorkChain` to submit the calculations in the internal loop.
+        The `self.ctx.inputs` dictionary is shared by every submission and
+        is never modified afterwards; see `get_sweep_inputs`.
         """
 
-        self.ctx.inputs = AttributeDict()
+        self.ctx.inputs = AttributeDict(
+            self.exposed_inputs(
+                InqBaseWorkChain, namespace='conv'
+            )
+        )
+        self.ctx.inputs.inq.structure = self.inputs.structure
+        self.ctx.inputs.use_cache = self.inputs.use_cache
+        self.ctx.parameters = self.ctx.inputs.inq.pop('parameters').get_dict()
+
         self.ctx.results = AttributeDict({'energy': {}, 'kspacing': {}})
 
         self.ctx.run_energy = True
         self.ctx.energy_iteration = 0
-        self.ctx.prev_energy = 0
+        self.ctx.energy_values = []
         energy_start = self.inputs.get('energy_start', None)
         if energy_start:
-            self.ctx.energy = energy_start
+            self.ctx.energy = energy_start.value
         else:
-            self.ctx.energy = suggested_energy_cutoff(self.inputs.structure)
+            self.ctx.energy = suggested_energy_cutoff(
+                self.inputs.structure,
+                {'pseudo_set': self.inputs.pseudo_set.value}
+            )
 
+        # The kspacing sweep runs alongside the energy sweep, so it uses the
+        # starting energy cutoff rather than the converged one.
+        self.ctx.kspacing_energy = self.ctx.energy
 
         self.ctx.run_kspacing = True
         self.ctx.kspacing_iteration = 0
         self.ctx.kpoint_mesh = '1 1 1'
         self.ctx.kspacing_step = self.inputs.kspacing_step.value
-        self.ctx.prev_kspacing = 0
+        self.ctx.kspacing_values = []
         self.ctx.kspacing = self.inputs.get('kspacing_start', None)
         self.ctx.kspacing = self.ctx.kspacing.value
+        self.ctx.kspacing_meshes = self.get_kspacing_meshes()
+        if not self.ctx.kspacing_meshes:
+            self.report(
+                f'No kpoint mesh finer than {self.ctx.kpoint_mesh} for kspacing '
+                f'values up to {self.ctx.kspacing}, skipping the kspacing sweep.'
+            )
+            self.ctx.run_kspacing = False
+            self.ctx.kspacing = None
+
+    def should_run_sweeps(self):
+        """
+        Check to see if either the energy or the kspacing sweep should run.
+        """
+
+        return self.should_run_energy() or self.should_run_kspacing()
+
+    def run_sweeps(self):
+        """
+        Launch the next energy and kspacing calculations at the same time.
+        """
+
+        self.ctx.sweeps = []
+        calcs = {}
+
+        if self.should_run_energy():
+            self.ctx.sweeps.append('energy')
+            calcs['energy_calc'] = self.run_energy()
+
+        if self.should_run_kspacing():
+            self.ctx.sweeps.append('kspacing')
+            calcs['kspacing_calc'] = self.run_kspacing()
+
+        return ToContext(**calcs)
+
+    def check_sweeps(self):
+        """
+        Inspect the calculations launched by `run_sweeps`.
+        """
+
+        calcs = {sweep: self.ctx[f'{sweep}_calc'] for sweep in self.ctx.sweeps}
+
+        for calc in calcs.values():
+            if not calc.is_finished_ok:
+                self.report(f'InqBaseWorkChain<{calc.pk}> failed.')
+                return self.exit_codes.INQ_CALCULATION_FAILED
+
+        total_energies = self.get_total_energies(calcs.values())
+        exit_codes = []
+
+        if 'energy' in calcs:
+            exit_codes.append(self.check_energy(total_energies[calcs['energy'].pk]))
+
+        if 'kspacing' in calcs:
+            exit_codes.append(self.check_kspacing(total_energies[calcs['kspacing'].pk]))
+
+        for exit_code in exit_codes:
+            if exit_code:
+                return exit_code
+
+        return
+
+    @staticmethod
+    def get_total_energies(calcs):
+        """
+        Fetch the total energies of finished workchains in a single query.
+
+        :param calcs: the `InqBaseWorkChain` nodes to query.
+
+        :return: dictionary mapping each workchain pk to its total energy.
+        """
+
+        builder = orm.QueryBuilder()
+        builder.append(
+            orm.WorkChainNode,
+            filters = {'id': {'in': [calc.pk for calc in calcs]}},
+            project = 'id',
+            tag = 'workchain'
+        )
+        builder.append(
+            orm.Dict,
+            with_incoming = 'workchain',
+            edge_filters = {'label': 'output_parameters'},
+            project = 'attributes.energy.total'
+        )
+
+        return dict(builder.all())
 
     def should_run_energy(self):
         """
@@ -247,59 +380,75 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
 
         return self.ctx.run_energy 
     
-    def run_energy(self):
+    def get_sweep_inputs(self, label, **overrides):
         """
-        Run a `InqBaseWorkChain` for each of the energy values.
+        Return the inputs for a single sweep calculation.
+
+        `AttributeDict` copies every nested mapping of `self.ctx.inputs`, and
+        the parameters get a new `Dict` node. Changes to the returned inputs
+        therefore never reach the base inputs or other submissions.
+
+        :param label: label and call link label of the calculation.
+        :param overrides: parameter namespaces, e.g. ``electrons``, whose
+            values are merged over the base parameters.
+
+        :return: an `AttributeDict` of inputs for `InqBaseWorkChain`.
         """
 
-        inputs = AttributeDict(
-            self.exposed_inputs(
-                InqBaseWorkchain, namespace='conv'
-            )
-        )
-        
-        parameters = AttributeDict(inputs.inq.pop('parameters').get_dict())
+        parameters = dict(self.ctx.parameters)
+        for namespace, values in overrides.items():
+            parameters[namespace] = {**parameters.get(namespace, {}), **values}
+
+        inputs = AttributeDict(self.ctx.inputs)
+        inputs.inq.parameters = orm.Dict(dict = parameters)
+        inputs.metadata = AttributeDict({
+            **self.ctx.inputs.get('metadata', {}),
+            'label': label,
+            'call_link_label': label
+        })
+
+        return inputs
+
+    def run_energy(self):
+        """
+        Submit a `InqBaseWorkChain` for the current energy cutoff.
+
+        :return: the submitted workchain node.
+        """
 
         self.ctx.energy_iteration += 1
-        inputs.inq.structure = self.inputs.structure
         energy = self.ctx.energy
-        parameters.electrons.cutoff = f'{energy} Ha'
-        inputs.inq.parameters = parameters
 
-        label = f'energy_{energy}'
-        inputs.metadata.label = label
-        inputs.metadata.call_link_label = label
+        inputs = self.get_sweep_inputs(
+            f'energy_{energy}',
+            electrons = {'cutoff': f'{energy} Ha'}
+        )
 
-        energy_calc = self.submit(InqBaseWorkchain, **inputs)
+        energy_calc = self.submit(InqBaseWorkChain, **inputs)
         self.report(f'launching InqBaseWorkchain<{energy_calc.pk}> with energy cutoff {energy} Ha')
 
-        return ToContext(energy_calc=energy_calc)
+        return energy_calc
     
-    def check_energy(self):
+    def check_energy(self, total_energy):
         """
         Inspect previous energy calculation.
+
+        :param total_energy: total energy of the finished calculation.
         """
 
         calc = self.ctx.energy_calc
 
-        if not calc.is_finished_ok:
-            self.report(f'InqBaseWorkChain<{calc.pk}> failed.')
-            return self.exit_codes.INQ_CALCULATION_FAILED
-        
-        results = calc.outputs.output_parameters.get_dict()
-        total_energy = results['energy']['total']
+        self.ctx.results.energy[calc.label] = total_energy
+        self.ctx.energy_values.append([self.ctx.energy, total_energy])
 
-        energy_diff = abs(self.ctx.prev_energy - total_energy)
+        converged = find_converged(self.ctx.energy_values, self.inputs.energy_delta.value)
 
-        if energy_diff > self.inputs.energy_delta:
-            self.ctx.prev_energy = total_energy
+        if converged is None:
             self.ctx.energy += self.inputs.energy_step.value
-            label = calc.label
-            self.ctx.results.energy[label] = total_energy
-        # If the energy difference is less than the delta than the previous step
-        # can be considered the converged result.
+        # If the energy difference to the next step is less than the delta,
+        # that step can be considered the converged result.
         else:
-            self.ctx.energy -= self.inputs.energy_step.value
+            self.ctx.energy = self.ctx.energy_values[converged][0]
             self.report(f'Converged with {self.ctx.energy} Ha and {self.ctx.energy_iteration} iterations.')
             self.ctx.run_energy = False
 
@@ -310,88 +459,107 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
 
         return
     
+    def get_kspacing_meshes(self):
+        """
+        Return the distinct kpoint meshes for all kspacing values that will
+        be tested, ordered from the largest to the smallest kspacing.
+
+        The meshes are computed in a single pass from the reciprocal cell,
+        following ``KpointsData.set_kpoints_mesh_from_density``. Kspacing
+        values that would give the same mesh as a larger one are skipped.
+
+        :return: list of ``[kspacing, mesh, label]`` entries, where mesh is
+            the grid string passed to INQ and label the calculation label.
+        """
+
+        cell = np.array(self.inputs.structure.cell)
+        reciprocal_lengths = np.linalg.norm(2 * np.pi * np.linalg.inv(cell).T, axis=1)
+
+        step = self.ctx.kspacing_step
+        num_values = max(int(np.floor(self.ctx.kspacing / step + 1e-8)), 1)
+        kspacings = np.around(self.ctx.kspacing - step * np.arange(num_values), 2)
+        kspacings = kspacings[kspacings > 0]
+
+        meshes = np.ceil(np.around(reciprocal_lengths[None, :] / kspacings[:, None], 5))
+        meshes = np.maximum(meshes, 1).astype(int)
+        # Non-periodic directions only need a single kpoint.
+        meshes[:, ~np.array(self.inputs.structure.pbc)] = 1
+
+        seen = {tuple(int(k) for k in self.ctx.kpoint_mesh.split())}
+        kspacing_meshes = []
+        for kspacing, mesh in zip(kspacings, meshes):
+            mesh = tuple(mesh.tolist())
+            if mesh in seen:
+                continue
+            seen.add(mesh)
+            kspacing = float(kspacing)
+            kspacing_meshes.append([
+                kspacing,
+                ' '.join(map(str, mesh)),
+                f'kspacing_{str(kspacing).replace(".", "_")}'
+            ])
+
+        return kspacing_meshes
+
     def should_run_kspacing(self):
         """
         Check to see if should run another kspacing simulation.
         """
 
-        return self.ctx.run_kspacing 
+        return self.ctx.run_kspacing
     
     def run_kspacing(self):
         """
-        Run a `InqBaseWorkChain` for each of the kspacing values.
+        Submit a `InqBaseWorkChain` for the next distinct kpoint mesh.
+
+        :return: the submitted workchain node.
         """
 
-        inputs = AttributeDict(
-            self.exposed_inputs(
-                InqBaseWorkchain, namespace='conv'
-            )
-        )
-        
-        parameters = AttributeDict(inputs.inq.pop('parameters').get_dict())
+        self.ctx.kspacing_iteration += 1
 
-        parameters.electrons.cutoff = f'{self.ctx.energy} Ha'
-        parameters.kpoints.grid = ''
+        # Meshes were precomputed in `setup`, duplicates already removed.
+        self.ctx.kspacing, self.ctx.kpoint_mesh, label = self.ctx.kspacing_meshes.pop(0)
 
-        self.ctx.kspacing_iteration += 1
-        inputs.inq.structure = self.inputs.structure
-
-        # Convert kspacing to kpoint mesh
-        calc_inputs = {
-            'structure': inputs.inq.structure,
-            'kspacing': self.ctx.kspacing
-        }
-        kpoints = create_kpoints_from_distance(**calc_inputs)    
-        kpoints = kpoints.get_kpoints_mesh()[0]
-        kpoints = ' '.join([str(k) for k in kpoints])
-
-        while kpoints == self.ctx.kpoint_mesh:
-            self.ctx.kspacing = np.around(self.ctx.kspacing - self.ctx.kspacing_step, 2)
-            calc_inputs['kspacing'] = self.ctx.kspacing
-            kpoints = create_kpoints_from_distance(**calc_inputs)
-            kpoints = kpoints.get_kpoints_mesh()[0]
-            kpoints = ' '.join([str(k) for k in kpoints])
-
-        self.ctx.kpoint_mesh = kpoints
-       
-        label = f'kspacing_{"_".join(str(self.ctx.kspacing).split("."))}'
-        parameters.kpoints.grid = self.ctx.kpoint_mesh
-        inputs.inq.parameters = parameters
-
-        inputs.metadata.label = label
-        inputs.metadata.call_link_label = label
-
-        kspacing_calc = self.submit(InqBaseWorkchain, **inputs)
+        inputs = self.get_sweep_inputs(
+            label,
+            electrons = {'cutoff': f'{self.ctx.kspacing_energy} Ha'},
+            kpoints = {'grid': self.ctx.kpoint_mesh}
+        )
+
+        kspacing_calc = self.submit(InqBaseWorkChain, **inputs)
         self.report(f'launching InqBaseWorkchain<{kspacing_calc.pk}> with kspacing {self.ctx.kspacing}')
 
-        return ToContext(kspacing_calc=kspacing_calc)
+        return kspacing_calc
     
-    def check_kspacing(self):
+    def check_kspacing(self, total_energy):
         """
         Inspect previous kspacing calculation.
+
+        :param total_energy: total energy of the finished calculation.
         """
 
         calc = self.ctx.kspacing_calc
 
-        if not calc.is_finished_ok:
-            self.report(f'InqBaseWorkChain<{calc.pk}> failed.')
-            return self.exit_codes.INQ_CALCULATION_FAILED
-        
-        results = calc.outputs.output_parameters.get_dict()
-        total_energy = results['energy']['total']
+        self.ctx.results.kspacing[calc.label] = total_energy
+        self.ctx.kspacing_values.append([self.ctx.kspacing, total_energy])
 
-        energy_diff = abs(self.ctx.prev_kspacing - total_energy)
+        converged = find_converged(self.ctx.kspacing_values, self.inputs.energy_delta.value)
 
-        if energy_diff > self.inputs.energy_delta:
-            self.ctx.prev_kspacing = total_energy
-            self.ctx.kspacing = np.around(self.ctx.kspacing - self.ctx.kspacing_step, 2)
-            label = calc.label
-            self.ctx.results.kspacing[label] = total_energy
-        # Previous step will be the converged kspacing value
-        else:
-            self.ctx.kspacing = np.around(self.ctx.kspacing + self.ctx.kspacing_step, 2)
+        # The first step within the delta of the next one is the converged
+        # kspacing value.
+        if converged is not None:
+            self.ctx.kspacing = self.ctx.kspacing_values[converged][0]
             self.report(f'Converged with {self.ctx.kspacing} kspacing and {self.ctx.kspacing_iteration} iterations.')
             self.ctx.run_kspacing = False
+        # Without any meshes left the sweep cannot converge, so no kspacing
+        # value is suggested.
+        elif not self.ctx.kspacing_meshes:
+            self.report(
+                f'Ran out of distinct kpoint meshes after kspacing {self.ctx.kspacing} '
+                'without converging; no kspacing will be suggested.'
+            )
+            self.ctx.run_kspacing = False
+            self.ctx.kspacing = None
 
         if self.ctx.kspacing_iteration >= self.inputs.max_iter:
             self.report(f'Reached the maximum number of iterations ({self.inputs.max_iter}).')
@@ -405,10 +573,11 @@ class InqConvergenceWorkChain(ProtocolMixin, WorkChain):
         Gather the final results and set it as output.
         """
 
-        suggested = orm.Dict(dict = {
-            'energy': self.ctx.energy,
-            'kspacing': self.ctx.kspacing
-        })
+        suggested = {'energy': self.ctx.energy}
+        if self.ctx.kspacing is not None:
+            suggested['kspacing'] = self.ctx.kspacing
+
+        suggested = orm.Dict(dict = suggested)
         suggested.store()
 
         results = orm.Dict(dict = self.ctx.results)
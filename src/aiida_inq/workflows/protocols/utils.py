@@ -3,6 +3,8 @@
 Utilities to manipulate the workflow input protocols.
 Most functionality comes from the AiiDA-QE plugin.
 """
+import copy
+import functools
 import pathlib
 from typing import Optional, Union
 import yaml
@@ -63,7 +65,9 @@ class ProtocolMixin:
             raise ValueError(
                 f'`{protocol}` is not a valid protocol. Call ``get_available_protocols`` to show available protocols.'
             ) from exception
-        inputs = recursive_merge(data['default_inputs'], protocol_inputs)
+        # The protocol data is shared between calls, so only the merged inputs
+        # of the selected protocol are copied before they are handed out.
+        inputs = copy.deepcopy(recursive_merge(data['default_inputs'], protocol_inputs))
         inputs.pop('description')
 
         if isinstance(overrides, pathlib.Path):
@@ -78,9 +82,33 @@ class ProtocolMixin:
     @classmethod
     def _load_protocol_file(cls) -> dict:
         """Return the contents of the protocol file for workflow class."""
-        with cls.get_protocol_filepath().open() as file:
-            return yaml.safe_load(file)
-        
+        return _load_protocol_data(cls)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_protocol_data(cls) -> dict:
+    """
+    Return the parsed protocol file of a workflow class.
+
+    Results are cached, so each file is read once and every caller gets the
+    same dictionary. Callers must not modify it; ``get_protocol_inputs``
+    deep-copies what it returns, and ``_load_pseudo_info`` is cached the
+    same way.
+    """
+    with cls.get_protocol_filepath().open() as file:
+        return yaml.safe_load(file)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_pseudo_info() -> dict:
+    """Return the parsed ``pseudos.yaml`` file with suggested energy cutoffs."""
+    from importlib_resources import files
+    from . import pseudos # type: ignore
+    pseudos_path = files(pseudos) / 'pseudos.yaml'
+
+    with open(pseudos_path, 'r') as infile:
+        return yaml.safe_load(infile)
+
 
 def suggested_energy_cutoff(
     structure,
@@ -91,18 +119,12 @@ def suggested_energy_cutoff(
     Return a suggested energy cutoff based on the provided protocol
     and pseudo_set designated.
     """
-    from importlib_resources import files
-    from . import pseudos # type: ignore
-    pseudos_path = files(pseudos) / 'pseudos.yaml'
     pseudo_set = inputs['pseudo_set']
 
     if protocol is None:
         protocol = 'moderate'
 
-    with open(pseudos_path, 'r') as infile:
-        pseudo_info = yaml.safe_load(infile)
-
-    values = pseudo_info.get(pseudo_set, None)
+    values = _load_pseudo_info().get(pseudo_set, None)
 
     atoms = structure.get_ase()
 
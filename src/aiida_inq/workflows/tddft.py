@@ -4,15 +4,12 @@
 from aiida import orm
 from aiida.common import AttributeDict
 from aiida.engine import WorkChain, ToContext
-from aiida.plugins import CalculationFactory, WorkflowFactory
-
+from ..calculations.inq import InqCalculation
+from .base import InqBaseWorkChain
 from .protocols.utils import ProtocolMixin, suggested_energy_cutoff
 
 import numpy as np
 
-InqCalculation = CalculationFactory('inq.inq')
-InqBaseWorkchain = WorkflowFactory('inq.base')
-
 
 class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
     """
@@ -24,7 +21,7 @@ class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
 
         super().define(spec)
         spec.expose_inputs(
-            InqBaseWorkchain,
+            InqBaseWorkChain,
             namespace = 'gs',
             exclude = ('clean_workdir', 'structure', 'inq.structure'),
             namespace_options = {
@@ -32,7 +29,7 @@ class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
             }
         )
         spec.expose_inputs(
-            InqBaseWorkchain,
+            InqBaseWorkChain,
             namespace = 'tddft',
             exclude = ('clean_workdir', 'structure', 'inq.structure'),
             namespace_options = {
@@ -118,7 +115,7 @@ class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
         # Get input values
         inputs = cls.get_protocol_inputs(protocol, overrides)
 
-        gs = InqBaseWorkchain.get_builder_from_protocol(
+        gs = InqBaseWorkChain.get_builder_from_protocol(
             code,
             structure,
             protocol = protocol,
@@ -127,7 +124,7 @@ class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
             **kwargs
         )
 
-        tddft = InqBaseWorkchain.get_builder_from_protocol(
+        tddft = InqBaseWorkChain.get_builder_from_protocol(
             code,
             structure,
             protocol = protocol,
@@ -165,17 +162,20 @@ class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
         """
         inputs = AttributeDict(
             self.exposed_inputs(
-                InqBaseWorkchain, namespace='gs'
+                InqBaseWorkChain, namespace='gs'
             )
         )
 
         inputs.structure = self.inputs.structure
 
         label = f'Ground_State'
-        inputs.metadata.label = label
-        inputs.metadata.call_link_label = label
+        inputs.metadata = AttributeDict({
+            **inputs.get('metadata', {}),
+            'label': label,
+            'call_link_label': label
+        })
 
-        ground_state = self.submit(InqBaseWorkchain, **inputs)
+        ground_state = self.submit(InqBaseWorkChain, **inputs)
         self.report(f'launching InqBaseWorkchain<{ground_state.pk}> for ground state calculation.')
 
         return ToContext(ground_state=ground_state)
@@ -203,7 +203,7 @@ class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
         """
         inputs = AttributeDict(
             self.exposed_inputs(
-                InqBaseWorkchain, namespace='tddft'
+                InqBaseWorkChain, namespace='tddft'
             )
         )
 
@@ -211,10 +211,13 @@ class InqTDDFTWorkChain(ProtocolMixin, WorkChain):
         inputs.inq.parent_folder = self.ctx.calc_parent_folder
 
         label = f'TDDFT'
-        inputs.metadata.label = label
-        inputs.metadata.call_link_label = label
+        inputs.metadata = AttributeDict({
+            **inputs.get('metadata', {}),
+            'label': label,
+            'call_link_label': label
+        })
 
-        tddft = self.submit(InqBaseWorkchain, **inputs)
+        tddft = self.submit(InqBaseWorkChain, **inputs)
         self.report(f'launching InqBaseWorkchain<{tddft.pk}> for tddft calculation.')
 
         return ToContext(tddft=tddft)